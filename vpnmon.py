@@ -24,6 +24,7 @@ import os                       # CLI and file handling
 import signal                   # Control-C handling
 import sys                      # Control-C handling
 import time                     # Delay timing
+from concurrent.futures import ThreadPoolExecutor   # Parallel pings
 
 # -------- Third party imports
 # None
@@ -31,11 +32,14 @@ import time                     # Delay timing
 # -------- Local module function imports
 from vpnmon_utilities import get_params
 from vpnmon_utilities import get_targets
+from vpnmon_utilities import resolve
 from vpnmon_utilities import pinger
 from vpnmon_utilities import webping
 from vpnmon_utilities import date_and_tod
 from vpnmon_utilities import sounder
 from vpnmon_utilities import datalogger
+from vpnmon_utilities import datalogger_check
+from vpnmon_utilities import datalogger_close
 
 # -------- Local module class imports
 from vpnmon_vpnclient import VPNClient
@@ -44,11 +48,32 @@ from vpnmon_vpnclient import VPNClient
 import vpnmon_shared_data as sd
 
 # -------- Constants
-# None
+TARGET_PING_MAX_WORKERS = 32    # Maximum concurrent target pings
+TARGET_PING_STAGGER = 0.010     # Seconds between ping submissions
 
 
 # -------- Methods
 
+def resolve_and_ping(siteurlip):
+    """Resolve a URL (with caching) and ping it
+
+    Runs on a worker thread, so that a slow DNS lookup (such as
+    for a target that cannot be resolved) only delays the ping
+    of that target, not the submission of the other pings.
+
+    Returns the pinger() result, or 'Fail' without running ping
+    if 'siteurlip' cannot be resolved (ping would only try the
+    same DNS lookup again).
+    """
+
+    ipaddress = resolve(siteurlip)
+    if ipaddress is None:
+        return 'Fail'           # Unresolvable URL
+    return pinger(ipaddress, p_count = 2)
+
+    # End of resolve_and_ping()
+
+
 def signal_handler(sig, frame):
     """Catch Control-C and do final cleanup before exiting
 
@@ -60,16 +85,18 @@ def signal_handler(sig, frame):
 
     print('\n---- vpnmon stopped with Control-C ----')
 
-    # Close the VPN connection, if it is open
+    # Close the VPN connection, if it is open, and shut down
+    # the Cisco AnyConnect CLI
     try:
-        if sd.vpnclient != '': sd.vpnclient.close()
+        if sd.vpnclient != '': sd.vpnclient.shutdown()
     except:
         pass
     print('VPN connection closed')
 
-    # Close the vpnmon datalog file, if it is open
+    # Write any queued test results and close the vpnmon datalog
+    # file, if it is open
     try:
-        if sd.datalogfile != '': sd.datalogfile.close()
+        datalogger_close()
     except:
         pass
     print('Datalog file closed')
@@ -93,14 +120,17 @@ def main():
     VPN site.
 
     The monitoring of a VPN site is done using test cycles. Each
-    test cycle starts with a ping to see if the VPN site responds.
-    If it does, then a VPN connection is attempted. If that works,
-    ping is used to see if zero or more systems behind the VPN
-    connection respond, and then the VPN connection is closed.
+    test cycle starts with a ping to see if the VPN site responds,
+    while a VPN connection is attempted at the same time. If the
+    connection works, ping is used to see if zero or more systems
+    behind the VPN connection respond, and then the VPN connection
+    is closed. (The VPN connection can optionally be kept open for
+    several test cycles before it is closed and opened again; see
+    the 'reopen_every' parameter.)
     Success/fail information is collected in a datalog file for
     all attempted test operations during each test cycle.
 
-    Successive test cycles are separated by specified delays.
+    Successive test cycles are started at specified intervals.
     Test cycles can be run either a specified number of times or
     continuously until the program is terminated with Control-C.
 
@@ -122,19 +152,39 @@ def main():
     # Create a VPN Client instance (shared data item)
     sd.vpnclient = VPNClient()
 
+    # Local aliases for values used throughout the test cycles
+    vpnclient = sd.vpnclient
+    vpnname = params['vpnname']
+    vpnurlip = params['vpnurlip']
+    quiet = params['quiet']
+    reopen_every = params['reopen_every']
+
     # Run the requested number of vpnmon test cycles
     count = params['cycles']
     if count < 0: cycles_target_str = 'of Infinite'
     else: cycles_target_str = 'of ' + str(count)
     test_cycle = 1
+    cycle_start = time.monotonic()  # Scheduled start of this cycle
+    vpn_is_open = False             # VPN connection state
+    cycles_open = 0                 # Test cycles run with it open
     while not count == 0:
 
+        # Format the test cycle number once for this test cycle
+        tc_str = str(test_cycle)
+        tc_pad = tc_str.rjust(3)
+
+        # Stop now if the results of the previous test cycle could
+        # not be written to the vpnmon datalog file (the write is
+        # done by a background thread, so a failure is only seen
+        # after datalogger() has returned)
+        datalogger_check()
+
         # Get vpnmon targets to test via the VPN connection
         targets = get_targets(params['targets'])
 
         # Output the number, date, and time of the test cycle start
         date, tod = date_and_tod()
-        print(str(test_cycle).rjust(3), date, tod, \
+        print(tc_pad, date, tod, \
                 'Start vpnmon test cycle', \
                 test_cycle, cycles_target_str)
 
@@ -147,88 +197,111 @@ def main():
         # =========================================================
         # -------- Test cycle activities are below --------
 
-        # TEST: ping the VPN site
-        date, tod = date_and_tod()
-        vpn_ping_result = pinger(params['vpnurlip'], p_count = 2)
+        # TEST: ping the VPN site and, at the same time, open the
+        # VPN connection. The ping runs on a worker thread while
+        # open() runs here, so the ping no longer adds to the time
+        # taken by the test cycle. open() stays on the main thread,
+        # so that only one thread ever uses the Cisco AnyConnect
+        # CLI, even when Control-C is entered during open(). The
+        # ping uses a cached DNS resolution; open() is still given
+        # the original URL, which AnyConnect needs to verify the
+        # server certificate. If the VPN connection was kept open
+        # by the previous test cycle (see 'reopen_every'), it is
+        # not opened again.
+        with ThreadPoolExecutor(max_workers = 1) as vpn_pinger:
+            date, tod = date_and_tod()
+            vpn_ping_future = vpn_pinger.submit(resolve_and_ping, \
+                                                vpnurlip)
+            vpn_open_result = None
+            if not vpn_is_open:
+                vpn_open_result = vpnclient.open(vpnurlip, \
+                                                 params['username'], \
+                                                 params['password'])
+
+            # Wait for the VPN ping to finish
+            vpn_ping_result = vpn_ping_future.result()
         if vpn_ping_result != 'Good':
-            sounder(s_count = 3, s_quiet = params['quiet'])
-        print(str(test_cycle).rjust(3), date, tod, \
+            sounder(s_count = 3, s_quiet = quiet)
+        print(tc_pad, date, tod, \
                 '-- VPN ping -----------', \
-                vpn_ping_result, params['vpnname'])
+                vpn_ping_result, vpnname)
         test_results['VPN ping'] = \
-            str(test_cycle) + ',' \
-            + date + ',' \
-            + tod + ',' \
-            + 'VPN ping' + ',' \
-            + vpn_ping_result + ',' \
-            + params['vpnurlip'] + ',' \
-            + params['vpnname'] \
-            + '\n'
-
-        # TEST: If the VPN ping was OK, open the VPN connection
-        vpn_open_result = 'Fail'    # Beginning assumption
-        if vpn_ping_result == 'Good':
-            date, tod = date_and_tod()
-            vpn_open_result = \
-                sd.vpnclient.open(params['vpnurlip'], \
-                params['username'], \
-                params['password'] )
-        if vpn_open_result != 'Good':
-            sounder(s_count = 3, s_quiet = params['quiet'])
-        print(str(test_cycle).rjust(3), date, tod, \
-                '-- VPN open() ---------', \
-                vpn_open_result, params['vpnname'])
-        test_results['VPN open'] = \
-            str(test_cycle) + ',' \
-            + date + ',' \
-            + tod + ',' \
-            + 'VPN open' + ',' \
-            + vpn_open_result + ',' \
-            + params['vpnurlip'] + ',' \
-            + params['vpnname'] \
-            + '\n'
-
-        # TEST: If the VPN is open, ping target systems through it
-        if vpn_open_result == 'Good':
-            for target in targets:
-                date, tod = date_and_tod()
-                target_ping_result = pinger(target, p_count = 2)
-                if target_ping_result != 'Good':
-                    sounder(s_count = 1, s_quiet = params['quiet'])
-                if target_ping_result == 'Good': tgood += 1
-                if target_ping_result == 'Warn': twarn += 1
-                if target_ping_result == 'Fail': tfail += 1
-                print(str(test_cycle).rjust(3), date, tod, \
-                        '-- ping', target.ljust(15), \
-                        target_ping_result, targets[target])
-                test_results[target] = \
-                    str(test_cycle) + ',' \
-                    + date + ',' \
-                    + tod + ',' \
-                    + 'Target ping' + ',' \
-                    + target_ping_result + ',' \
-                    + target + ',' \
-                    + targets[target] \
-                    + '\n'
-
-        # TEST: If the VPN is open, close it
-        if vpn_open_result == 'Good':
+            f'{tc_str},{date},{tod},VPN ping,' \
+            f'{vpn_ping_result},' \
+            f'{vpnurlip},{vpnname}\n'
+        if vpn_open_result is None:
+            # The VPN connection was kept open; there is no new
+            # VPN open result to record in the datalog file
+            print(tc_pad, date, tod, \
+                    '-- VPN open() ---------', \
+                    'Kept', vpnname)
+        else:
+            vpn_is_open = vpn_open_result == 'Good'
+            cycles_open = 0
+            if vpn_open_result != 'Good':
+                sounder(s_count = 3, s_quiet = quiet)
+            print(tc_pad, date, tod, \
+                    '-- VPN open() ---------', \
+                    vpn_open_result, vpnname)
+            test_results['VPN open'] = \
+                f'{tc_str},{date},{tod},VPN open,' \
+                f'{vpn_open_result},' \
+                f'{vpnurlip},{vpnname}\n'
+
+        # TEST: If the VPN is open, ping target systems through it.
+        # The pings are I/O bound, so they are run concurrently by
+        # a pool of worker threads. Submissions are staggered a
+        # little to avoid bursts of ICMP packets, and the results
+        # are collected (and reported) on the main thread in the
+        # same order as the targets file, so that console output
+        # and datalog entries are not interleaved. The console
+        # lines for all the targets are output together.
+        if vpn_is_open and len(targets) > 0:
+            workers = min(TARGET_PING_MAX_WORKERS, len(targets))
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                pending = []
+                for target, target_name in targets.items():
+                    date, tod = date_and_tod()
+                    future = executor.submit(resolve_and_ping, target)
+                    pending.append((target, target_name, future, date, tod))
+                    time.sleep(TARGET_PING_STAGGER)
+                ping_lines = []
+                for target, target_name, future, date, tod in pending:
+                    target_ping_result = future.result()
+                    if target_ping_result != 'Good':
+                        sounder(s_count = 1, s_quiet = quiet)
+                    if target_ping_result == 'Good': tgood += 1
+                    if target_ping_result == 'Warn': twarn += 1
+                    if target_ping_result == 'Fail': tfail += 1
+                    ping_lines.append(f'{tc_pad} {date} {tod} ' \
+                                      f'-- ping {target.ljust(15)} ' \
+                                      f'{target_ping_result} ' \
+                                      f'{target_name}')
+                    test_results[target] = \
+                        f'{tc_str},{date},{tod},Target ping,' \
+                        f'{target_ping_result},{target},{target_name}\n'
+            # Output all the target ping lines with one print()
+            print('\n'.join(ping_lines))
+
+        # TEST: If the VPN is open, close it once it has been used
+        # for 'reopen_every' test cycles, or if this is the last
+        # test cycle
+        if vpn_is_open:
+            cycles_open += 1
+        if vpn_is_open and (cycles_open >= reopen_every \
+                            or count == 1):
             date, tod = date_and_tod()
-            vpn_close_result = sd.vpnclient.close()
+            vpn_close_result = vpnclient.close()
+            vpn_is_open = False
             if vpn_close_result != 'Good':
-                sounder(s_count = 3, s_quiet = params['quiet'])
-            print(str(test_cycle).rjust(3), date, tod, \
+                sounder(s_count = 3, s_quiet = quiet)
+            print(tc_pad, date, tod, \
                     '-- VPN close() --------', \
-                    vpn_close_result, params['vpnname'])
+                    vpn_close_result, vpnname)
             test_results['VPN close'] = \
-                str(test_cycle) + ',' \
-                + date + ',' \
-                + tod + ',' \
-                + 'VPN close' + ',' \
-                + vpn_close_result + ',' \
-                + params['vpnurlip'] + ',' \
-                + params['vpnname'] \
-                + '\n'
+                f'{tc_str},{date},{tod},VPN close,' \
+                f'{vpn_close_result},' \
+                f'{vpnurlip},{vpnname}\n'
 
         # -------- Test cycle activities are above --------
         # =========================================================
@@ -238,32 +311,52 @@ def main():
         if datalogger_result != 'Good':
             print('Unable to record test results')
 
-        # Output the number, date, and time of the test cycle end
+        # Output the number, date, and time of the test cycle end,
+        # and the test cycle ping summary for target systems
         date, tod = date_and_tod()
-        print(str(test_cycle).rjust(3), date, tod, \
-                'End vpnmon test cycle', \
-                test_cycle, cycles_target_str)
-
-        # Output test cycle ping summary for target systems
-        print(str(test_cycle).rjust(3), ' ', date, ' ', tod, ' ', \
-            'vpnmon test cycle ping results:', '  Good: ', tgood, \
-            ',  Warn: ', twarn, ',  Fail: ', tfail, sep='')
+        end_lines = [f'{tc_pad} {date} {tod} End vpnmon test cycle ' \
+                     f'{test_cycle} {cycles_target_str}', \
+                     f'{tc_pad} {date} {tod} ' \
+                     f'vpnmon test cycle ping results:  Good: {tgood}' \
+                     f',  Warn: {twarn},  Fail: {tfail}']
 
         # Determine if another test cycle is expected,
         # where a negative count means run continuously
         if count > 0: count -= 1        # Decrement only if positve
+        if count != 0:
+            end_lines.append(f'{tc_pad} {date} {tod} ' \
+                             'Waiting to run next test cycle.\n')
+
+        # Output all the test cycle end lines with one print()
+        print('\n'.join(end_lines))
         if count == 0: continue         # Stop if done
-        date, tod = date_and_tod()
-        print(str(test_cycle).rjust(3), date, tod, \
-                'Waiting to run next test cycle.\n')
         test_cycle += 1                 # More to do
-        time.sleep(params['delay'])     # Wait between test cycles
+
+        # Wait between test cycles. The delay is measured from the
+        # scheduled start of one test cycle to the next, so the
+        # time taken by the test cycles does not make the schedule
+        # drift. If a test cycle took longer than the delay, the
+        # schedule restarts from now instead of running the late
+        # test cycles back to back.
+        cycle_start += params['delay']
+        now = time.monotonic()
+        if cycle_start < now: cycle_start = now
+        time.sleep(cycle_start - now)
 
     # Announce the completion of the requested number of test cycles
     date, tod = date_and_tod()
     print(str(test_cycle).rjust(3), date, tod, \
             test_cycle, 'vpnmon test cycles completed.')
 
+    # Shut down the Cisco AnyConnect CLI, which the VPN Client
+    # instance keeps running between test cycles
+    vpnclient.shutdown()
+
+    # Write any queued test results and close the vpnmon datalog
+    # file, which datalogger() keeps open
+    if datalogger_close() != 'Good':
+        print('Unable to record test results')
+
     # End program
     exit(0)                     # Normal exit
 
@@ -9,4 +9,4 @@ ddeel 210418
 
 vpnclient = ''                  # VPN Client instance
 
-datalogfile = ''                # datalog file handle
+datalogfile = ''                # datalog file descriptor
@@ -5,11 +5,17 @@
 This is a collection of utility methods used by vpnmon:
     get_params()    - Get operational parameters for vpnmon
     get_targets()   - Get a list of targets to test via the VPN
+    resolve()       - Resolve a URL to an IP address, with caching
     pinger()        - Ping a URL or IP address
     webping()       - See if a web site is responding
     date_and_tod()  - Return date and time of day as a tuple
     sounder()       - Make one or more sounds to get attention
     datalogger()    - Write test results to a datalog file
+    datalogger_check() - Exit if the datalog file cannot be written
+    datalogger_close() - Finish writing and close the datalog file
+
+It also provides the MultiBuffer class, which passes datalog
+data from the test cycles to the datalog writer thread.
 
 Document strings provide more information about each method below.
 
@@ -18,13 +24,19 @@ ddeel 210418
 
 # -------- Standard library imports
 import argparse                 # CLI handling
+import csv                      # Params and targets file parsing
+import locale                   # Datalog file encoding
 import os                       # CLI and file handling
-import time                     # Delay timing
-from datetime import datetime   # Date and time
+import queue                    # Sounder queue
+import random                   # Datalog retry jitter
+import socket                   # DNS resolution
+import subprocess               # OS ping command
+import threading                # Datalog writer thread
+import time                     # Delay timing, date and time
 
 # -------- Third party imports
-from pythonping import ping     # Python-based ping
 import requests                 # HTTP handling for webping
+from requests.adapters import HTTPAdapter   # HTTP connection pooling
 
 # -------- Local module function imports
 from vpnmon_version import __version__      # vpnmon version
@@ -39,7 +51,191 @@ VPNMON_PARAMS_FILE  = 'vpnmon_params.csv'
 VPNMON_TARGETS_FILE_DEFAULT = 'vpnmon_targets.csv'
 VPNMON_DATALOG_FILE_DEFAULT = 'vpnmon_datalog.csv'
 VPNMON_DATALOG_WRITE_MAX_RETRIES = 5
-VPNMON_DATALOG_WRITE_RETRY_DELAY = 15
+VPNMON_DATALOG_WRITE_RETRY_DELAY = 0.5     # First retry delay
+VPNMON_DATALOG_WRITE_RETRY_DELAY_MAX = 8   # Longest retry delay
+VPNMON_DATALOG_WRITE_RETRY_JITTER = 0.25   # Random extra delay
+VPNMON_DATALOG_BUFFER_COUNT = 4
+VPNMON_DATALOG_BUFFER_SIZE = 4 * 1024
+VPNMON_DNS_CACHE_TTL = 900      # Seconds to keep a DNS resolution
+VPNMON_DNS_FAILURE_TTL = 60     # Seconds to remember a failed lookup
+VPNMON_SOUND_INTERVAL = 0.30    # Seconds between sounds
+VPNMON_WEBPING_POOL_SIZE = 10   # Web sites kept connected by webping
+
+
+# -------- Module data
+_params_cache = {}              # File name -> (mtime, params)
+_targets_cache = {}             # File name -> (mtime, targets)
+_dns_cache = {}                 # Host name -> (IP address, expiry time)
+_date_and_tod_cache = (None, '', '')    # (second, date, tod)
+_sound_queue = queue.Queue()    # Sound counts waiting to be played
+_sounder = None                 # Sounder thread
+_webping_session = None         # HTTP session shared by webping()
+_datalog_writer = None          # Datalog writer thread
+_datalog_error = None           # Fatal error from the writer thread
+
+
+# -------- Classes
+
+class MultiBuffer:
+    """Set of reusable byte buffers shared by two threads
+
+    A MultiBuffer passes data from a collector thread to a
+    flusher thread through a fixed set of fixed-size byte
+    buffers, which are allocated once and reused. The amount
+    of data in each buffer is kept as a separate fill length,
+    so the buffers are never resized. Each buffer is always in
+    one of four states:
+        EMPTY:      Available to the collector.
+        FILLING:    Being filled by the collector.
+        FULL:       Waiting for the flusher.
+        FLUSHING:   Being flushed by the flusher.
+
+    The collector calls append() to add one record (such as a
+    CSV row) to the FILLING buffer. A record is never split
+    between buffers: if it does not fit in the space left, the
+    FILLING buffer becomes FULL and the record starts the next
+    buffer. A record larger than a whole buffer is passed on by
+    itself, in place of a buffer's contents. The FILLING buffer
+    also becomes FULL when the collector calls rollover(). The
+    flusher calls take_full() to get the contents of a FULL
+    buffer, writes them out, and then calls release() to make
+    the buffer EMPTY again. If the flusher has to drop a
+    buffer, only whole records are lost.
+
+    append() waits if every buffer is FULL or FLUSHING, so a
+    stalled flusher slows the collector down rather than
+    letting buffered data grow without limit.
+    """
+
+    EMPTY = 0
+    FILLING = 1
+    FULL = 2
+    FLUSHING = 3
+
+    def __init__(self, count=VPNMON_DATALOG_BUFFER_COUNT, \
+                 size=VPNMON_DATALOG_BUFFER_SIZE):
+        """Constructor for a MultiBuffer instance
+        """
+
+        self._size = size
+        self._buffers = [bytearray(size) for x in range(count)]
+        self._lengths = [0] * count     # Bytes of data in each buffer
+        self._oversize = [None] * count  # Record too big for a buffer
+        self._states = [MultiBuffer.EMPTY] * count
+        self._filling = None    # Index of the FILLING buffer
+        self._full = []         # Indexes of FULL buffers, oldest first
+        self._condition = threading.Condition()
+
+        # End of __init__()
+
+
+    def append(self, data):
+        """Add one record of bytes to the FILLING buffer (collector)
+        """
+
+        with self._condition:
+            # Start the record in the next buffer if it does not
+            # fit in the space left in the FILLING buffer
+            if self._filling is not None and \
+                    self._lengths[self._filling] + len(data) > self._size:
+                self._mark_full()
+            if self._filling is None:
+                self._condition.wait_for(lambda: \
+                    MultiBuffer.EMPTY in self._states)
+                self._filling = self._states.index(MultiBuffer.EMPTY)
+                self._states[self._filling] = MultiBuffer.FILLING
+            index = self._filling
+
+            # A record that is too big for any buffer is passed on
+            # by itself, instead of the buffer's contents
+            if len(data) > self._size:
+                self._oversize[index] = bytes(data)
+                self._lengths[index] = len(data)
+                self._mark_full()
+                return
+
+            # Copy the record into the FILLING buffer
+            start = self._lengths[index]
+            self._buffers[index][start:start + len(data)] = data
+            self._lengths[index] = start + len(data)
+            if self._lengths[index] >= self._size:
+                self._mark_full()
+
+        # End of append()
+
+
+    def rollover(self):
+        """Hand the FILLING buffer to the flusher (collector)
+        """
+
+        with self._condition:
+            if self._filling is not None \
+                    and self._lengths[self._filling] > 0:
+                self._mark_full()
+
+        # End of rollover()
+
+
+    def take_full(self):
+        """Wait for a FULL buffer and start flushing it (flusher)
+
+        Returns the index of the buffer and a memoryview of the
+        data in the buffer, which stays valid until release().
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._full) > 0)
+            index = self._full.pop(0)
+            self._states[index] = MultiBuffer.FLUSHING
+            data = self._oversize[index]
+            if data is None:
+                data = self._buffers[index]
+            return index, memoryview(data)[:self._lengths[index]]
+
+        # End of take_full()
+
+
+    def release(self, index):
+        """Finish flushing a buffer and make it EMPTY (flusher)
+        """
+
+        with self._condition:
+            self._lengths[index] = 0
+            self._oversize[index] = None
+            self._states[index] = MultiBuffer.EMPTY
+            self._condition.notify_all()
+
+        # End of release()
+
+
+    def drain(self):
+        """Roll over, then wait until every buffer is flushed
+        """
+
+        with self._condition:
+            if self._filling is not None \
+                    and self._lengths[self._filling] > 0:
+                self._mark_full()
+            self._condition.wait_for(lambda: \
+                MultiBuffer.FULL not in self._states \
+                and MultiBuffer.FLUSHING not in self._states)
+
+        # End of drain()
+
+
+    def _mark_full(self):
+        """Make the FILLING buffer FULL (condition must be held)
+        """
+
+        self._states[self._filling] = MultiBuffer.FULL
+        self._full.append(self._filling)
+        self._filling = None
+        self._condition.notify_all()
+
+        # End of _mark_full()
+
+
+_datalog_buffers = MultiBuffer()    # CSV bytes waiting to be written
 
 
 # -------- Methods
@@ -59,9 +255,14 @@ def get_params():
                     the list of URLs or IP addresses, and
                     then close the VPN. (-1 means run until
                     stopped by Control-C.)
-        delay:      Seconds between VPN test cycles.
+        delay:      Seconds between the starts of VPN test
+                    cycles.
         datalog:    CSV file for collected test data.
         quiet:      Do not make sounds for test failures.
+        reopen_every: Number of test cycles to run with the
+                    same VPN connection before closing it and
+                    opening it again. (1 means open and close
+                    the VPN in every test cycle.)
 
     vpnmon operational parameters can be set by an optional
     vpnmon parameters file and/or by optional vpnmon command
@@ -95,7 +296,8 @@ def get_params():
               'cycles': 200,
               'delay': 1800,
               'datalog': VPNMON_DATALOG_FILE_DEFAULT,
-              'quiet': False}
+              'quiet': False,
+              'reopen_every': 1}
 
     # Read in an optional vpnmon parameters file containing one
     # or more parameters. If this file is missing or empty, the
@@ -104,20 +306,31 @@ def get_params():
     # the name of the parameter, followed by a comma, followed
     # by the parameter value. Parameter names that are not
     # already defined in the params dictionary are ignored.
+    # Fields are read literally; quote characters are part of a
+    # value (such as a password), not CSV quoting.
+    # The parsed file contents are cached, and the file is only
+    # parsed again if its modification time changes.
     if os.path.exists(VPNMON_PARAMS_FILE):
         try:
-            paramsfile = open(VPNMON_PARAMS_FILE, 'r')
-            for line in paramsfile:
-                # Remove end of line and split into fields
-                line = line.replace('\n', '')
-                param_entry = line.split(',', 2)
-                # Only accept defined parameters
-                if param_entry[0].lower() in params:
-                    params[param_entry[0].lower()] = param_entry[1]
-            # Ensure integer parameters are integers
-            params['cycles'] = int(params['cycles'])
-            params['delay'] = int(params['delay'])
-            paramsfile.close()
+            mtime = os.stat(VPNMON_PARAMS_FILE).st_mtime_ns
+            cached = _params_cache.get(VPNMON_PARAMS_FILE)
+            if cached is not None and cached[0] == mtime:
+                params.update(cached[1])
+            else:
+                with open(VPNMON_PARAMS_FILE, 'r', newline='') as paramsfile:
+                    for param_entry in csv.reader(paramsfile, \
+                            quoting = csv.QUOTE_NONE):
+                        # Only accept defined parameters
+                        if len(param_entry) >= 2 \
+                                and param_entry[0].lower() in params:
+                            params[param_entry[0].lower()] = param_entry[1]
+                # Ensure integer parameters are integers, and
+                # boolean parameters are booleans
+                params['cycles'] = int(params['cycles'])
+                params['delay'] = int(params['delay'])
+                params['reopen_every'] = int(params['reopen_every'])
+                params['quiet'] = str(params['quiet']).lower() == 'true'
+                _params_cache[VPNMON_PARAMS_FILE] = (mtime, params.copy())
         except Exception as error:
             print('Failed to read the vpnmon params file:')
             print(error)
@@ -149,27 +362,30 @@ def get_params():
     parser.add_argument('-cycles', '--cycles', type = int,
         help='Number of test cycles to run')
     parser.add_argument('-delay', '--delay', type = int,
-        help='Seconds between test cycles')
+        help='Seconds between the starts of test cycles')
     parser.add_argument('-datalog', '--datalog',
         help='CSV file for the vpnmon datalog')
     parser.add_argument('-quiet', '--quiet', action='store_true',
         help='Do not make sounds for test failures')
-    args = parser.parse_args()
-    if args.version:            # Show version and exit
+    parser.add_argument('-noquiet', '--no-quiet', dest='quiet',
+        action='store_false',
+        help='Make sounds for test failures')
+    parser.add_argument('-reopen_every', '--reopen_every', type = int,
+        help='Test cycles to run before reopening the VPN connection')
+    # The parameters file and default values become the argparse
+    # defaults, so every parameter that is not on the command
+    # line keeps its current value
+    parser.set_defaults(**params)
+    args = vars(parser.parse_args())
+    if args.pop('version'):     # Show version and exit
         print('vpnmon version', __version__)
         exit(0)
-    if not(args.vpnname==None): params['vpnname'] = args.vpnname
-    if not(args.vpnurlip==None): params['vpnurlip'] = args.vpnurlip
+    params.update(args)
     if params['vpnurlip']=='':
         print('Cannot run without a VPN site URL or IP address.')
         exit(0)
-    if not(args.username==None): params['username'] = args.username
-    if not(args.password==None): params['password'] = args.password
-    if not(args.targets==None): params['targets'] = args.targets
-    if not(args.cycles==None): params['cycles'] = args.cycles
-    if not(args.delay==None): params['delay'] = args.delay
-    if not(args.datalog==None): params['datalog'] = args.datalog
-    if not(args.quiet==None): params['quiet'] = args.quiet
+    if params['reopen_every'] < 1:
+        params['reopen_every'] = 1
     return params
 
     # End of get_params()
@@ -196,6 +412,10 @@ def get_targets(targets_file):
     A list of targets is returned as a dictionary that can
     be empty.
 
+    The targets file is only parsed again when its modification
+    time changes, so calling get_targets() at the start of every
+    test cycle is cheap when the file has not been edited.
+
     Note: A fatal error exit will occur if the optional vpnmon
     targets file is present but cannot be accessed.
     """
@@ -203,19 +423,23 @@ def get_targets(targets_file):
     targets = {}
     if os.path.exists(targets_file):
         try:
-            targets_file = open(targets_file, 'r')
-            for line in targets_file:
-                # Remove end of line and split into fields
-                line = line.replace('\n', '')
-                ip_and_name = line.split(',', 2)
-                # Check for lines that have been commented out
-                if ip_and_name[0][0] == '#' or ip_and_name[0][0] ==' ':
-                    # Skip lines with an initial "#" or " " character
-                    pass
-                else:
-                    # Only use the first two fields on a line
-                    targets[ip_and_name[0]] = ip_and_name[1]
-            targets_file.close()
+            # Return a copy of the cached targets if the targets
+            # file has not been modified since it was last parsed
+            mtime = os.stat(targets_file).st_mtime_ns
+            cached = _targets_cache.get(targets_file)
+            if cached is not None and cached[0] == mtime:
+                return cached[1].copy()
+            # Only use the first two fields on a line, and skip
+            # lines with an initial "#" or " " character (which
+            # have been commented out) or without two fields. Fields
+            # are read literally, without any CSV quoting.
+            with open(targets_file, 'r', newline='') as targetsfile:
+                targets = {ip_and_name[0]: ip_and_name[1] \
+                           for ip_and_name in csv.reader(targetsfile, \
+                               quoting = csv.QUOTE_NONE) \
+                           if len(ip_and_name) >= 2 \
+                           and ip_and_name[0][:1] not in ('#', ' ', '')}
+            _targets_cache[targets_file] = (mtime, targets.copy())
         except Exception as error:
             print('Failed to read the vpnmon targets file:')
             print(error)
@@ -229,11 +453,51 @@ def get_targets(targets_file):
     # End of get_targets()
 
 
+def resolve(siteurlip, ttl=VPNMON_DNS_CACHE_TTL):
+    """Resolve a URL to an IP address, with caching
+
+    Looks up the IP address for a URL (host name) and remembers
+    it for 'ttl' seconds, so that repeated test cycles do not
+    pay for a DNS lookup every time a target is pinged.
+
+    Arguments:
+        siteurlip:  URL or IP address to resolve.
+        ttl:        Seconds to keep a resolved IP address
+                    (default is VPNMON_DNS_CACHE_TTL).
+
+    Returns the IP address as a string. Returns None if the
+    lookup fails, so that the caller can report the failure
+    without doing anything that would look up 'siteurlip' again
+    (such as running ping with the host name). A failed lookup
+    is remembered for VPNMON_DNS_FAILURE_TTL seconds, so that an
+    unresolvable name does not make every test cycle wait for
+    the DNS resolver timeout.
+    """
+
+    now = time.monotonic()
+    cached = _dns_cache.get(siteurlip)
+    if cached is not None and cached[1] > now:
+        return cached[0]        # Cached entry is still fresh
+
+    try:
+        ipaddress = socket.gethostbyname(siteurlip)
+    except (OSError, UnicodeError):
+        # Report the failure, and remember it briefly
+        _dns_cache[siteurlip] = (None, \
+                                 now + min(ttl, VPNMON_DNS_FAILURE_TTL))
+        return None
+    _dns_cache[siteurlip] = (ipaddress, now + ttl)
+    return ipaddress
+
+    # End of resolve()
+
+
 def pinger(siteurlip, p_count=1, p_timeout=1.000):
     """Run ping on a URL or IP address
 
-    Provides a generic version of the ping command. Uses one
-    or more ping commands to see if a target is responding.
+    Provides a generic version of the ping command. Uses the
+    Windows ping command to send one or more pings, to see if
+    a target is responding.
 
     Arguments:
         siteurlip:  URL or IP address of the ping target.
@@ -247,13 +511,24 @@ def pinger(siteurlip, p_count=1, p_timeout=1.000):
     Returns 'Warn' if some but not all ping responses time out.
     """
 
-    good = 0
-    for i in range(0, p_count):
-        ping_list = ping(siteurlip,
-                         count = p_count, \
-                         timeout = p_timeout)
-        if ping_list._responses[0].success:
-            good += 1
+    # Send all the pings with a single run of the Windows ping
+    # command, then count the echo replies in its output. Each
+    # echo reply line includes 'TTL='; other responses, such as
+    # 'Destination host unreachable', do not (even though ping
+    # counts them as 'Received' and exits with 0 for them).
+    ping_cmd = ['ping', \
+                '-n', str(p_count), \
+                '-w', str(int(p_timeout * 1000)), \
+                siteurlip]
+    try:
+        ping_run = subprocess.run(ping_cmd, \
+                                  stdin = subprocess.DEVNULL, \
+                                  stdout = subprocess.PIPE, \
+                                  stderr = subprocess.DEVNULL, \
+                                  timeout = p_count * (p_timeout + 1) + 5)
+        good = min(ping_run.stdout.count(b'TTL='), p_count)
+    except (OSError, subprocess.SubprocessError):
+        good = 0                # Unable to run ping at all
 
     if good == p_count:
         return 'Good'           # All pings succeeded
@@ -277,10 +552,23 @@ def webping(siteurlip, wp_timeout=5.0):
 
     Returns 'Good' if the web site responds with an HTTP "OK"
     Code (200). Returns 'Fail' if any other response is received.
+
+    All calls share one HTTP session, so repeated checks of the
+    same web site can reuse its connection (and TLS session)
+    instead of setting up a new one every time.
     """
 
+    global _webping_session     # HTTP session shared by webping()
+
+    if _webping_session is None:
+        _webping_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = VPNMON_WEBPING_POOL_SIZE, \
+                              pool_maxsize = VPNMON_WEBPING_POOL_SIZE)
+        _webping_session.mount('http://', adapter)
+        _webping_session.mount('https://', adapter)
+
     try:
-        response = requests.get(siteurlip, timeout=wp_timeout)
+        response = _webping_session.get(siteurlip, timeout=wp_timeout)
         result = response.status_code
     except:
         result = 0
@@ -299,12 +587,23 @@ def date_and_tod():
     Returns the current date and time as a tuple of two strings.
     The first string is the current date, and the second string
     is the current time.
+
+    The strings only change once per second, so the formatted
+    strings are cached and only formatted again when the second
+    changes.
     """
 
-    now = datetime.now()
-    date = now.strftime('%Y/%m/%d')
-    tod = now.strftime('%H:%M:%S')
-    return date, tod
+    global _date_and_tod_cache  # (second, date, tod)
+
+    now = int(time.time())
+    cached = _date_and_tod_cache
+    if cached[0] != now:
+        local_now = time.localtime(now)
+        cached = (now, \
+                  time.strftime('%Y/%m/%d', local_now), \
+                  time.strftime('%H:%M:%S', local_now))
+        _date_and_tod_cache = cached
+    return cached[1], cached[2]
 
     # End of date_and_tod()
 
@@ -314,17 +613,43 @@ def sounder(s_count=1, s_quiet=False):
 
     Makes a sound 'count' times in rapid succession, but
     only when 's_quiet' is False.
+
+    The sounds are made by a background sounder thread (started
+    on the first call), so sounder() returns immediately instead
+    of waiting while the sounds are spaced out.
     """
 
+    global _sounder             # Sounder thread
+
     if not(s_quiet):
-        for x in range(s_count):
-            print('\a', end='', flush=True)
-            time.sleep(0.30)
+        if _sounder is None:
+            _sounder = threading.Thread(target = _sounder_loop, \
+                                        name = 'vpnmon sounder', \
+                                        daemon = True)
+            _sounder.start()
+        _sound_queue.put(s_count)
     return
 
     # End of sounder()
 
 
+def _sounder_loop():
+    """Sounder thread
+
+    Makes the sounds requested by sounder(), one request at a
+    time, with a short pause between sounds so they can be
+    heard separately.
+    """
+
+    while True:
+        s_count = _sound_queue.get()
+        for x in range(s_count):
+            print('\a', end='', flush=True)
+            time.sleep(VPNMON_SOUND_INTERVAL)
+
+    # End of _sounder_loop()
+
+
 def datalogger(datalog_file, test_data):
     """Write test results to a datalog file
 
@@ -333,62 +658,204 @@ def datalogger(datalog_file, test_data):
     'test_data' is expected to be a dictionary of any size in
     CSV format, with one line per test result entry.
 
+    The write itself is done by a background datalog writer
+    thread (started on the first call). datalogger() only
+    copies 'test_data' into the datalog MultiBuffer and hands
+    it to the writer thread, without waiting for any disk I/O.
+    Each call is handed over as soon as it is copied, so the
+    datalog file is updated once per test cycle. See
+    _datalog_write() for the details of how the datalog file
+    is written.
+
+    Returns 'Good' when 'test_data' has been handed to the
+    datalog writer thread.
+
+    Note: A fatal error exit will occur (see datalogger_check())
+    if the datalog writer thread was unable to access
+    'datalog_file' for any reason other than the situation where
+    another program is using the file. The check is done both
+    before and after the test data is handed over.
+
+    Note: Call datalogger_close() before the program ends, so
+    that all buffered test data is written to 'datalog_file'.
+    """
+
+    global _datalog_writer      # Datalog writer thread
+
+    # Check for a fatal error in the datalog writer thread
+    datalogger_check()
+
+    # Start the datalog writer thread, if it is not running yet
+    if _datalog_writer is None:
+        _datalog_writer = threading.Thread(target = _datalog_writer_loop, \
+                                           args = (datalog_file,), \
+                                           name = 'vpnmon datalog writer', \
+                                           daemon = True)
+        _datalog_writer.start()
+
+    # Copy the test data into the datalog buffers, using the
+    # platform line ending and the locale encoding (which is what
+    # a text mode file uses, and is also used to read the targets
+    # file), and hand it to the writer thread
+    encoding = locale.getpreferredencoding(False)
+    for entry in test_data:
+        _datalog_buffers.append( \
+            test_data[entry].replace('\n', os.linesep).encode(encoding))
+    _datalog_buffers.rollover()
+
+    # Check again, in case the writer thread has failed while
+    # the test data was being handed over
+    datalogger_check()
+    return 'Good'
+
+    # End of datalogger()
+
+
+def datalogger_check():
+    """Exit if the datalog file cannot be written
+
+    Checks for a fatal error in the datalog writer thread, and
+    does the fatal error exit here, on the calling thread. This
+    is called by datalogger(), and should also be called at the
+    start of each test cycle, so that vpnmon stops before it
+    runs another test cycle whose results cannot be recorded.
+
+    Returns 'Good' if there is no fatal datalog error.
+    """
+
+    if _datalog_error is not None:
+        print('Failed to access the vpnmon datalog file:')
+        print(_datalog_error)
+        # Shut down the VPN Client instance (shared data item)
+        try:
+            sd.vpnclient.shutdown()
+        except:
+            pass
+        # Exit with a fatal error
+        print('vpnmon fatal error exit.')
+        exit(1)
+    return 'Good'
+
+    # End of datalogger_check()
+
+
+def datalogger_close():
+    """Finish writing test results and close the datalog file
+
+    Waits until the datalog writer thread has written all the
+    test data buffered by datalogger(), and then closes the
+    datalog file.
+
+    Returns 'Good' when all buffered test data was written.
+    Returns 'Fail' if the datalog writer thread had a fatal
+    error accessing the datalog file.
+    """
+
+    if _datalog_writer is not None:
+        _datalog_buffers.drain()    # Wait for pending writes
+    try:
+        if sd.datalogfile != '': os.close(sd.datalogfile)
+    except:
+        pass
+    sd.datalogfile = ''
+
+    if _datalog_error is not None:
+        print('Failed to access the vpnmon datalog file:')
+        print(_datalog_error)
+        return 'Fail'
+    return 'Good'
+
+    # End of datalogger_close()
+
+
+def _datalog_writer_loop(datalog_file):
+    """Datalog writer thread
+
+    Takes FULL buffers from the datalog MultiBuffer and writes
+    them into 'datalog_file', one buffer at a time, for as
+    long as the program runs. Buffers are discarded after a
+    fatal datalog file error, which datalogger_check() reports.
+    """
+
+    while True:
+        index, buf = _datalog_buffers.take_full()
+        try:
+            if _datalog_error is None:
+                _datalog_write(datalog_file, buf)
+        finally:
+            _datalog_buffers.release(index)
+
+    # End of _datalog_writer_loop()
+
+
+def _datalog_write(datalog_file, buf):
+    """Write one buffer of CSV bytes to the datalog file
+
+    Runs on the datalog writer thread.
+
     Includes a limited tolerance for the possibility that
     another program (such as an datalog analysis program)
-    might be accessing the datalog file when datalogger()
-    needs to write more data into the datalog file.
-
-    Returns 'Good' when 'test_data' is successfully written
-    into 'datalog_file'. Returns 'Fail' when 'test_data'
-    cannot be written into 'datalog_file' because another
-    program is accessing 'datalog_file'.
-
-    Note: A fatal error exit will occur if 'datalog_file'
-    cannot be accessed for any reason other than the
-    situation where another program is using the file.
-
-    Note: The datalog file handle is kept as a shared data
-    item (sd.datalogfile), so that it can be used to close
-    the datalog file whenever the program is ended with
-    Control-C.
+    might be accessing the datalog file when more data needs
+    to be written into the datalog file.
+
+    Returns 'Good' when 'buf' is successfully written into
+    'datalog_file'. Returns 'Fail' when 'buf' cannot be
+    written into 'datalog_file' because another program is
+    accessing 'datalog_file'. Any other error accessing
+    'datalog_file' is saved in _datalog_error, so that
+    datalogger_check() can do a fatal error exit.
+
+    Note: The datalog file is opened on the first call and then
+    kept open for the life of the program. Its OS-level file
+    descriptor is kept as a shared data item (sd.datalogfile),
+    so that it can be used to close the datalog file whenever
+    the program is ended with Control-C.
     """
 
+    global _datalog_error       # Fatal datalog file error
+
     return_value = 'Fail'       # Beginning assumption
+    data = memoryview(buf)      # Data not written yet
     write_retry = VPNMON_DATALOG_WRITE_MAX_RETRIES
+    retry_delay = VPNMON_DATALOG_WRITE_RETRY_DELAY
     while write_retry > 0:
         try:
-            sd.datalogfile = open(datalog_file, 'a')
-            for entry in test_data:
-                sd.datalogfile.write(test_data[entry])
-            sd.datalogfile.close()
+            # Open the datalog file on first use and keep it open,
+            # then write the whole buffer with os.write(), which
+            # goes straight to the OS without any more buffering.
+            # A retry only writes what was not written before, so
+            # no test results are written twice.
+            if sd.datalogfile == '':
+                sd.datalogfile = os.open(datalog_file, \
+                    os.O_WRONLY | os.O_CREAT | os.O_APPEND \
+                    | getattr(os, 'O_BINARY', 0))
+            while len(data) > 0:
+                data = data[os.write(sd.datalogfile, data):]
         except PermissionError as error:
             # Inadequate file access rights. This can occur if
             # another program is accessing the datalog file when
             # the write is attempted. The write will be retried
-            # a limited number of times, waiting a few seconds
-            # between each attempt. If it still cannot succeed,
-            # the write attempt is aborted.
+            # a limited number of times, waiting between each
+            # attempt. The wait starts short and doubles after
+            # each attempt (up to a limit), with a little random
+            # jitter added. If it still cannot succeed, the write
+            # attempt is aborted.
             write_retry -= 1
             if write_retry > 0:
                 print('Cannot open the vpnmon datalog file;', \
                       'retrying')
-                time.sleep(VPNMON_DATALOG_WRITE_RETRY_DELAY)
+                time.sleep(retry_delay + \
+                    random.uniform(0, VPNMON_DATALOG_WRITE_RETRY_JITTER))
+                retry_delay = min(retry_delay * 2, \
+                                  VPNMON_DATALOG_WRITE_RETRY_DELAY_MAX)
             else:
                 print('Unable to open the vpnmon datalog file')
                 print('Aborting this attempt to record results')
-                print('Skipping forward to the next test cycle')
             continue
         except Exception as error:
-            print('Failed to access the vpnmon datalog file:')
-            print(error)
-            # Shut down the VPN Client instance (shared data item)
-            try:
-                sd.vpnclient.close()
-            except:
-                pass
-            # Exit with a fatal error
-            print('vpnmon fatal error exit.')
-            exit(1)
+            # Save the error for datalogger_check() to report
+            _datalog_error = error
+            write_retry = 0
         else:
             # If a 'retrying' message was printed because of a
             # PermissionError above, print a message here that
@@ -399,4 +866,4 @@ def datalogger(datalog_file, test_data):
             return_value = 'Good'   # Success case
     return return_value
 
-    # End of datalogger()
+    # End of _datalog_write()
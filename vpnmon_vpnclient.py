@@ -2,14 +2,20 @@
 
 """VPNClient Class
 
-This VPNClient class provides open() and close() methods for
-using the Windows Cisco AnyConnect Secure Mobility Client CLI.
+This VPNClient class provides open(), reconnect(), close(), and
+shutdown() methods for using the Windows Cisco AnyConnect Secure
+Mobility Client CLI.
 
 After creating an instance of the VPNClient class, programs are
 expected to call open(), use the VPN connection, and then call
-close(). The open()/close() sequence can be done multiple times.
-Failure to call close() can result in the VPN connection being
-left open when the calling program ends.
+close(). The open()/close() sequence can be done multiple times,
+and the Cisco AnyConnect CLI started by the first open() is kept
+running between them. After a successful open(), reconnect() can
+be used to open the VPN connection again using the running CLI.
+Programs are expected to call shutdown() when they are done, to
+close the VPN connection (if it is open) and end the Cisco
+AnyConnect CLI. Failure to call shutdown() can result in the VPN
+connection being left open when the calling program ends.
 
 The user should not attempt to use another AnyConnect application
 at the same time that an instance of this class is active on the
@@ -30,56 +36,329 @@ ddeel 210418
 
 # Imports
 import wexpect                  # App interaction handling
+import ctypes                   # Process list handling
+import logging                  # Diagnostic message handling
+import ctypes.wintypes          # Process list handling
+import re                       # Expect pattern handling
+import subprocess               # taskkill handling
 import time                     # Delay timing
+from contextlib import contextmanager   # Step failure handling
+from functools import lru_cache         # Expect pattern caching
 
 # Constants
-VPNCLI_CMD_DELAY = 0.5          # vpncli command delay in seconds
-WEXPECT_TIMEOUT = 120           # wexpect timeout in seconds
+VPNCLI_CMD_DELAY = 0.5          # Longest vpncli command delay in seconds
+VPNCLI_SETTLE_TIME = 0.05       # Seconds of vpncli silence before a command
+WEXPECT_TIMEOUT = 120           # wexpect default timeout in seconds
+PROMPT_TIMEOUT = 5              # cmd.exe prompt timeout in seconds
+CLI_START_TIMEOUT = 30          # vpncli start timeout in seconds
+DISCONNECT_TIMEOUT = 30         # VPN disconnect timeout in seconds
+CONNECT_TIMEOUT = 30            # VPN connect timeout in seconds
+AUTH_TIMEOUT = 60               # VPN credentials timeout in seconds
+BANNER_TIMEOUT = 60             # VPN banner accept timeout in seconds
+CLI_EXIT_TIMEOUT = 1.0          # Wait for the CLI to end by itself
+CLI_EXIT_POLL = 0.05            # Seconds between CLI exit checks
+_TASKKILL = ['taskkill', '/f']  # Forced Windows task kill command
+_CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', \
+                            0x08000000)  # Not in subprocess before 3.7
+_TH32CS_SNAPPROCESS = 0x2       # Toolhelp snapshot of all processes
+_INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value   # Failed snapshot
+
+# Logger for error messages and diagnostic information. With no
+# logging configuration, errors still go to the console (stderr),
+# and the recent Cisco AnyConnect CLI output is only logged when
+# DEBUG logging is enabled for this module.
+_log = logging.getLogger(__name__)
+
+# Expect patterns, compiled once rather than on every expect().
+# wexpect matches str patterns against decoded str output, so these
+# are compiled from str (not bytes) patterns. wexpect compiles plain
+# str patterns with re.DOTALL, so the same flag is used here.
+_CMD_PROMPT_PAT = re.compile('>', re.DOTALL)        # cmd.exe prompt
+_VPN_PROMPT_PAT = re.compile('VPN>', re.DOTALL)     # vpncli prompt
+_PASSWORD_PAT = re.compile('Password:', re.DOTALL)  # Password prompt
+_SETTLE_PATS = [wexpect.TIMEOUT, \
+                re.compile('.+', re.DOTALL)]        # Any vpncli output
+_CONNECT_PATS = [re.compile(p, re.DOTALL) for p in \
+                    ('Username:', \
+                     'unsuccessful domain name', \
+                     r'Connect not available\.', \
+                     'cannot verify server')] + [wexpect.TIMEOUT]
+_CREDS_PATS = [re.compile(p, re.DOTALL) for p in \
+                    (r'accept\?', \
+                     'Login failed')] + [wexpect.TIMEOUT]
+_BANNER_PATS = [re.compile(p, re.DOTALL) for p in \
+                    ('state: Connected', \
+                     'Please try connecting again', \
+                     'driver encountered an error')] + [wexpect.TIMEOUT]
+
+
+# Classes used by functions
+
+class _PROCESSENTRY32W(ctypes.Structure):
+    """Windows PROCESSENTRY32W structure, used by _running_images()
+    """
+
+    _fields_ = [('dwSize', ctypes.wintypes.DWORD), \
+                ('cntUsage', ctypes.wintypes.DWORD), \
+                ('th32ProcessID', ctypes.wintypes.DWORD), \
+                ('th32DefaultHeapID', ctypes.c_void_p), \
+                ('th32ModuleID', ctypes.wintypes.DWORD), \
+                ('cntThreads', ctypes.wintypes.DWORD), \
+                ('th32ParentProcessID', ctypes.wintypes.DWORD), \
+                ('pcPriClassBase', ctypes.c_long), \
+                ('dwFlags', ctypes.wintypes.DWORD), \
+                ('szExeFile', ctypes.c_wchar * 260)]
+
+
+# Functions
+
+def _running_images(*images):
+    """Find out which executable images are running
+
+    Returns the set of the named executable 'images' (such as
+    'vpncli.exe', in lower case) that have at least one running
+    instance. Uses a Windows Toolhelp process snapshot, which is
+    much cheaper than starting a tasklist or taskkill process.
+
+    Raises OSError if the process snapshot cannot be taken.
+    """
+
+    wanted = {image.lower() for image in images}
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = ctypes.wintypes.HANDLE
+    snapshot = kernel32.CreateToolhelp32Snapshot(_TH32CS_SNAPPROCESS, 0)
+    if snapshot is None or snapshot == _INVALID_HANDLE_VALUE:
+        raise OSError('Unable to take a process snapshot.')
+
+    running = set()
+    try:
+        entry = _PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(entry)
+        more = kernel32.Process32FirstW(ctypes.wintypes.HANDLE(snapshot), \
+                                        ctypes.byref(entry))
+        while more:
+            name = entry.szExeFile.lower()
+            if name in wanted:
+                running.add(name)
+            more = kernel32.Process32NextW(ctypes.wintypes.HANDLE(snapshot), \
+                                           ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(ctypes.wintypes.HANDLE(snapshot))
+    return running
+
+    # End of _running_images()
+
+
+@lru_cache(maxsize = 16)
+def _connected_pat(vpnsitename):
+    """Get the expect pattern for a VPN site connection
+
+    Returns a compiled pattern that matches the Cisco AnyConnect
+    CLI message for a connection to 'vpnsitename'. The site name
+    is matched literally, and the pattern is only compiled once
+    for each site name.
+    """
+
+    return re.compile('Connected to ' + re.escape(vpnsitename), re.DOTALL)
+
+    # End of _connected_pat()
+
+
+def _kill_anyconnect(*images):
+    """Terminate Cisco AnyConnect applications
+
+    Runs the Windows taskkill command once to force all running
+    instances of the named executable 'images' (such as
+    'vpncli.exe') to end. taskkill is run directly, without a
+    shell or a console window, and is not run at all if none of
+    the named images are running (the usual case).
+
+    Raises an exception if taskkill cannot be run. It is not an
+    error if no instances of the named images are running.
+    """
+
+    # Only kill the images that are running; if that cannot be
+    # found out, let taskkill look for all of them
+    try:
+        images = sorted(_running_images(*images))
+    except Exception as error:
+        pass
+    if not images:
+        return
+
+    command = list(_TASKKILL)
+    for image in images:
+        command += ['/im', image]
+    subprocess.run(command, \
+                   stdin = subprocess.DEVNULL, \
+                   stdout = subprocess.DEVNULL, \
+                   stderr = subprocess.DEVNULL, \
+                   creationflags = _CREATE_NO_WINDOW, \
+                   check = False)
+
+    # End of _kill_anyconnect()
+
+
+# Classes
+
+class _StepFailed(Exception):
+    """A VPNClient step failed
+
+    Raised by VPNClient._fail() after the failure has been
+    reported and the Cisco AnyConnect CLI instance has been shut
+    down, so that the caller can simply return 'Fail'.
+    """
 
 
 class VPNClient:
 
+    # Cisco AnyConnect CLI location on Windows
+    _VPNCLI_PATH = r'c:\"Program Files (x86)"\Cisco' \
+                   r'\"Cisco AnyConnect Secure Mobility Client"\vpncli'
+
     def __init__(self):
         """Constructor for a VPNClient instance
         """
 
+        self._vpn_proc = None       # Spawned process
+        self._cli_ready = False     # CLI is waiting for a command
+
         # End of __init__()
 
 
-    def open(self, vpnsitename, vpnusername, vpnpassword):
-        """Open the VPN connection
+    def _settle(self):
+        """Wait for the Cisco AnyConnect CLI to become idle
 
-        Opens a VPN connection using the Cisco AnyConnect CLI.
+        vpncli can ignore a command that arrives too soon after
+        its previous output. Rather than always waiting for
+        VPNCLI_CMD_DELAY before each command, this waits only
+        until vpncli has produced no output for VPNCLI_SETTLE_TIME
+        seconds, and never longer than VPNCLI_CMD_DELAY in total.
+        Any output that arrives while waiting is discarded.
+        """
+
+        proc = self._vpn_proc
+        deadline = time.monotonic() + VPNCLI_CMD_DELAY
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return          # Waited as long as allowed
+            index = proc.expect(_SETTLE_PATS, \
+                        timeout = min(VPNCLI_SETTLE_TIME, remaining))
+            if index == 0:
+                return          # vpncli is idle
+
+        # End of _settle()
+
+
+    def _send(self, command, patterns, timeout=-1):
+        """Send a command to the Cisco AnyConnect CLI
+
+        Waits for vpncli to become idle, sends 'command', and then
+        waits for one of 'patterns' (a pattern or a list of them,
+        as accepted by wexpect's expect(), normally one of the
+        precompiled module patterns) to be received.
+
+        Returns the index of the pattern that was received, just
+        like wexpect's expect(). 'timeout' is the number of seconds
+        to wait for 'patterns'; each step passes its own timeout,
+        so that a failing step returns quickly. A 'timeout' of -1
+        uses the wexpect timeout set when the child process was
+        spawned (WEXPECT_TIMEOUT).
+        """
 
-        Spawns a child process, starts the Cisco Anyconnect CLI,
-        and then opens a VPN connection. The Cisco AnyConnect CLI
-        started by open() is also be used by close() to close the
-        VPN connection.
+        proc = self._vpn_proc
+        self._settle()
+        proc.sendline(command)
+        return proc.expect(patterns, timeout = timeout)
+
+        # End of _send()
+
+
+    def _terminate(self):
+        """Shut down the Cisco AnyConnect CLI instance
+
+        Terminates the child process and ensures the Cisco
+        AnyConnect CLI instance is shut down.
 
         Returns 'Good' for success and 'Fail' for failure.
-        Failures also result in error messages being sent to the
-        console. Failure situations where no recovery is possible
-        result in a hard exit for both this method and the caller.
+        """
 
-        Terminates all other Cisco AnyConnect applications, because
-        only one Cisco AnyConnect application can run at a time.
+        proc = self._vpn_proc
+        self._cli_ready = False
+        try:
+            if proc is not None:
+                proc.terminate(force=True)
+            _kill_anyconnect('vpncli.exe')
+        except Exception as error:
+            _log.error('Unable to terminate child process.')
+            return 'Fail'
+        return 'Good'
 
-        wexpect note: Each major step provides its own stimulus
-        and verifies the response with one or more 'expect' items
-        before the control flow moves on to the next step. Note
-        that a log file can be used with wexpect for debugging,
-        but it will record and reveal VPN usernames and passwords.
+        # End of _terminate()
 
-        vpncli note: Short delays are needed between CLI commands,
-        otherwise one or more commands can be ignored by the CLI.
-        The approach for working with vpncli states and behaviors
-        comes from empirical evidence, which may be incomplete.
+
+    def _fail(self, *messages, fatal=False):
+        """Report a failed step and shut down the CLI instance
+
+        Logs 'messages' as an error and the recent Cisco AnyConnect
+        CLI output as debug information, and then shuts down the
+        Cisco AnyConnect CLI instance. Does a hard exit if 'fatal'
+        is True (there is no way to recover); otherwise raises
+        _StepFailed (recovery might still be possible).
         """
 
-        # Cisco AnyConnect CLI location on Windows
-        cisco_dir = 'c:\\"Program Files (x86)"\\Cisco'
-        cisco_cli = '\\"Cisco AnyConnect Secure Mobility Client"'
-        vpncli = cisco_dir + cisco_cli + '\\vpncli'
+        proc = self._vpn_proc
+        _log.error('\n'.join(messages))
+        if proc is not None and _log.isEnabledFor(logging.DEBUG):
+            _log.debug('before: %s', proc.before)
+        self._terminate()
+        if fatal:
+            exit(1)
+        raise _StepFailed()
+
+        # End of _fail()
+
+
+    @contextmanager
+    def _step(self, *messages, fatal=False):
+        """Run one step of working with the Cisco AnyConnect CLI
+
+        Used as 'with self._step(...):' around each major step.
+        If the step raises an unexpected exception, the failure is
+        handled by _fail() using 'messages' and 'fatal'. Failures
+        that the step itself reports with _fail() are passed on.
+        """
+
+        try:
+            yield
+        except _StepFailed:
+            raise
+        except Exception as error:
+            self._fail(*messages, fatal=fatal)
+
+        # End of _step()
+
+
+    def _ensure_cli(self):
+        """Make sure the Cisco AnyConnect CLI is running
+
+        Does nothing if the Cisco AnyConnect CLI started by an
+        earlier call is still running and waiting for a command.
+        Otherwise, terminates all other Cisco AnyConnect
+        applications (because only one Cisco AnyConnect
+        application can run at a time), spawns a child process,
+        and starts the Cisco AnyConnect CLI in it.
+
+        Failure situations where no recovery is possible result
+        in a hard exit for both this method and the caller.
+        """
+
+        # Reuse the Cisco AnyConnect CLI if it is already running
+        proc = self._vpn_proc
+        if self._cli_ready and proc.isalive():
+            return
+        self._cli_ready = False
 
         # Log file for debug; should normally be set to None,
         # because the log file will show VPN login credentials
@@ -87,314 +366,217 @@ class VPNClient:
         # Normal use:   vpn_log_file = None
         vpn_log_file = None
 
-        # Globals
-        global vpn_proc         # Spawned process ID
-
-
         # Terminate all other Cisco AnyConnect applications, because
         # only one Cisco AnyConnect application can run at a time
         try:
-            wexpect.host.run('taskkill /f /im vpnui.exe')
-            wexpect.host.run('taskkill /f /im vpncli.exe')
+            _kill_anyconnect('vpnui.exe', 'vpncli.exe')
         except Exception as error:
-            print('Unable to end an existing AnyConnect UI or CLI.')
+            _log.error('Unable to end an existing AnyConnect UI or CLI.')
             # There is no way to recover; do a hard exit
             exit(1)
 
         # Spawn a child process to run the Cisco AnyConnect CLI
-        try:
-            vpn_proc = wexpect.spawn('cmd.exe', \
-                                     timeout = WEXPECT_TIMEOUT, \
-                                     logfile = vpn_log_file)
-            vpn_proc.expect('>')
-        except Exception as error:
-            print('Unable to spawn child process', \
-                  'to run the Cisco AnyConnect CLI.')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # There is no way to recover; do a hard exit
-            exit(1)
+        # (there is no way to recover from a failure)
+        self._vpn_proc = None
+        with self._step('Unable to spawn child process ' \
+                        'to run the Cisco AnyConnect CLI.', fatal=True):
+            proc = wexpect.spawn('cmd.exe', \
+                                 timeout = WEXPECT_TIMEOUT, \
+                                 logfile = vpn_log_file)
+            self._vpn_proc = proc
+            proc.expect(_CMD_PROMPT_PAT, timeout = PROMPT_TIMEOUT)
 
         # Start vpncli, which is the Cisco AnyConnect CLI
-        try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline(vpncli)
-            vpn_proc.expect('VPN>')
-        except Exception as error:
-            print('Unable to use the Cisco AnyConnect CLI.')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # There is no way to recover; attempt to shut down the
-            # Cisco AnyConnect CLI instance (in case it got started)
-            # and do a hard exit
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (136).')
-            exit(1)
+        # (there is no way to recover from a failure)
+        with self._step('Unable to use the Cisco AnyConnect CLI.', \
+                        fatal=True):
+            self._send(self._VPNCLI_PATH, _VPN_PROMPT_PAT, \
+                       CLI_START_TIMEOUT)
 
-        # Make sure the VPN is disconnected
-        try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline('disconnect')
-            vpn_proc.expect('VPN>')
-        except Exception as error:
-            print('Unable to disconnect the VPN for open().')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # There is no way to recover; attempt to shut down the
-            # Cisco AnyConnect CLI instance and do a hard exit
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (155)')
-            exit(1)
+        # The Cisco AnyConnect CLI is now waiting for a command
+        self._cli_ready = True
 
-        # Initiate a connection with the VPN site
-        try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline('connect ' + vpnsitename)
-            index = vpn_proc.expect(['Username:', \
-                                     'unsuccessful domain name', \
-                                     'Connect not available.', \
-                                     'cannot verify server', \
-                                     wexpect.TIMEOUT])
-            if index == 1:
-                # Unable to contact the VPN site
-                print('Unable to contact', vpnsitename)
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # This could be a temporary situation, so recovery
-                # might still be possible; attempt to shut down the
-                # Cisco AnyConnect CLI instance and return with a
-                # failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (181).')
-                return 'Fail'
-            if index == 2:
-                # Another Cisco AnyConnect application is running
-                print('Another AnyConnect UI or CLI is running.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # There is no way to recover; attempt to shut down
-                # the Cisco AnyConnect CLI instance and return with
-                # a failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (196).')
-                return 'Fail'
-            if index == 3:
-                # Cisco AnyConnect cannot verify the VPN server
-                print('AnyConnect cannot verify the VPN server.')
-                print('There may be a server certificate issue.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # There is no way to recover; attempt to shut down
-                # the Cisco AnyConnect CLI instance and return with
-                # a failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (212).')
-                return 'Fail'
-            if index == 4:
-                # Timeout waiting for VPN connection response
-                print(vpnsitename,'is not responding.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # This could be a temporary situation, so recovery
-                # might still be possible; attempt to shut down the
-                # Cisco AnyConnect CLI instance and return with a
-                # failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (228).')
-                return 'Fail'
-        except Exception as error:
-            # An unanticipated VPN connection error occurred
-            print('Got an unexpected VPN connection error.')
-            print('Unable to complete VPN connection setup.')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # This could be a temporary situation, so recovery
-            # might still be possible; attempt to shut down the
-            # Cisco AnyConnect CLI instance and return with a
-            # failure
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (245).')
-            return 'Fail'
+        # End of _ensure_cli()
 
-        # Enter the VPN login credentials
-        try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline(vpnusername)
-            vpn_proc.expect('Password:')
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline(vpnpassword)
-            index = vpn_proc.expect(['accept?', \
-                                     'Login failed', \
-                                     wexpect.TIMEOUT])
-            if index == 1:
-                # Username and/or Password was not accepted
-                print('VPN Username/Password was not accepted.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # The Cisco AnyConnect CLI is now only listening
-                # for Username/Password entry, and there is no
-                # way to recover; attempt to shut down the Cisco
-                # AnyConnect CLI instance and return 'Fail'
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (272).')
-                return 'Fail'
-            if index == 2:
-                # Timeout waiting for VPN credential entry response
-                print('VPN credentials response timeout.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # This could be a temporary situation, so recovery
-                # might still be possible; attempt to shut down the
-                # Cisco AnyConnect CLI instance and return with a
-                # failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (288).')
-                return 'Fail'
-        except Exception as error:
-            # An unanticipated VPN credentials error occurred
-            print('Got an unexpected VPN credentials error.')
-            print('Unable to accept VPN connection credentials.')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # This could be a temporary situation, so recovery
-            # might still be possible; attempt to shut down the
-            # Cisco AnyConnect CLI instance and return with a
-            # failure
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (305).')
+
+    def open(self, vpnsitename, vpnusername, vpnpassword):
+        """Open the VPN connection
+
+        Opens a VPN connection using the Cisco AnyConnect CLI.
+
+        Spawns a child process and starts the Cisco Anyconnect CLI
+        (unless the CLI started by an earlier open() is still
+        running), and then opens a VPN connection (see
+        _tunnel_up()). The Cisco AnyConnect CLI is also used by
+        close() to close the VPN connection, and is kept running
+        until shutdown() is called.
+
+        Returns 'Good' for success and 'Fail' for failure.
+        Failures also result in error messages being sent to the
+        console. Failure situations where no recovery is possible
+        result in a hard exit for both this method and the caller.
+
+        When the Cisco AnyConnect CLI is started, terminates all
+        other Cisco AnyConnect applications, because only one Cisco
+        AnyConnect application can run at a time.
+        """
+
+        # Make sure the Cisco AnyConnect CLI is running, starting
+        # it if needed (this may do a hard exit)
+        self._ensure_cli()
+        return self._tunnel_up(vpnsitename, vpnusername, vpnpassword)
+
+        # End of open()
+
+
+    def reconnect(self, vpnsitename, vpnusername, vpnpassword):
+        """Open the VPN connection again
+
+        Opens a VPN connection using the Cisco AnyConnect CLI that
+        is already running, without starting it and without ending
+        other Cisco AnyConnect applications. Any open VPN
+        connection is disconnected first. This is intended for
+        retrying a VPN connection after open() has succeeded, when
+        only the VPN connection (not the CLI) needs rebuilding.
+
+        Returns 'Good' for success and 'Fail' for failure.
+        Failures also result in error messages being sent to the
+        console. 'Fail' is returned if the Cisco AnyConnect CLI
+        is not running (for example, after a failure or after
+        shutdown()); use open() to start it again.
+        """
+
+        # The Cisco AnyConnect CLI must already be running
+        proc = self._vpn_proc
+        if not self._cli_ready or not proc.isalive():
+            self._cli_ready = False
+            _log.error('The Cisco AnyConnect CLI is not running.')
             return 'Fail'
 
-        # Accept the VPN banner
+        return self._tunnel_up(vpnsitename, vpnusername, vpnpassword)
+
+        # End of reconnect()
+
+
+    def _tunnel_up(self, vpnsitename, vpnusername, vpnpassword):
+        """Bring up the VPN connection
+
+        Uses the running Cisco AnyConnect CLI to disconnect any
+        open VPN connection, connect with 'vpnsitename', enter the
+        VPN login credentials, and accept the VPN banner. Used by
+        open() and reconnect().
+
+        Returns 'Good' for success and 'Fail' for failure.
+        Failures also result in error messages being sent to the
+        console. Failure situations where no recovery is possible
+        result in a hard exit for both this method and the caller.
+
+        wexpect note: Each major step provides its own stimulus
+        and verifies the response with one or more 'expect' items
+        before the control flow moves on to the next step. Note
+        that a log file can be used with wexpect for debugging,
+        but it will record and reveal VPN usernames and passwords.
+
+        vpncli note: Short delays are needed between CLI commands,
+        otherwise one or more commands can be ignored by the CLI.
+        Each command waits until the CLI output has gone quiet,
+        for no longer than VPNCLI_CMD_DELAY (see _settle()).
+        This includes 'connect', which is only sent after vpncli
+        has finished 'disconnect' and shown its prompt again,
+        because a 'connect' that arrives during a disconnect could
+        be ignored. The approach for working with vpncli states
+        and behaviors comes from empirical evidence, which may be
+        incomplete.
+
+        Failure note: Each major step is run by _step(), which
+        reports any failure, shuts down the Cisco AnyConnect CLI
+        instance, and then either does a hard exit or raises
+        _StepFailed, which is turned into a 'Fail' return here.
+        Failures that might be temporary return 'Fail', so that
+        recovery might still be possible.
+        """
+
+        proc = self._vpn_proc
+
+        # Site-specific command and expect pattern
+        connect_cmd = f'connect {vpnsitename}'
+        connected_pat = _connected_pat(vpnsitename)
+
         try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline('y')
-            index = vpn_proc.expect(['state: Connected', \
-                                     'Please try connecting again', \
-                                     'driver encountered an error', \
-                                     wexpect.TIMEOUT])
-            if index == 1:
-                # Unable to establish a connection this time
-                print('Unable to establish a connection this time')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # This could be a temporary situation, so recovery
-                # might still be possible; attempt to shut down the
-                # Cisco AnyConnect CLI instance and return with a
-                # failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (330).')
-                return 'Fail'
-            if index == 2:
-                # The Cisco VPN client driver needs a system reboot
-                print('The VPN client driver encountered an error.')
-                print('Please restart your system, then try again.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # The Cisco AnyConnect CLI has requested a system
-                # reboot, and there is no way to recover; attempt
-                # to shut down the Cisco AnyConnect CLI instance
-                # and return with a failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (347).')
-                return 'Fail'
-            if index == 3:
-                # Timeout waiting for the VPN banner accept response
-                print('Banner accept response timeout.')
-                print('---- Start diagnostic information ----')
-                print(vpn_proc.before)
-                print('----  End diagnostic information  ----')
-                # This could be a temporary situation, so recovery
-                # might still be possible; attempt to shut down the
-                # Cisco AnyConnect CLI instance and return with a
-                # failure
-                try:
-                    vpn_proc.terminate(force=True)
-                    wexpect.host.run('taskkill /f /im vpncli.exe')
-                except Exception as error:
-                    print('Unable to terminate child process (363).')
-                return 'Fail'
-            # Success case, if two final checks are satisfied
-            vpn_proc.expect('Connected to ' + vpnsitename)
-            vpn_proc.expect('VPN>')
-        except Exception as error:
-            # An unanticipated error occurred
-            print('Got an unexpected VPN banner accept error.')
-            print('Unable to successfully accept the VPN banner.')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # This could be a temporary situation, so recovery
-            # might still be possible; attempt to shut down the
-            # Cisco AnyConnect CLI instance and return with a
-            # failure
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (383).')
+            # Make sure the VPN is disconnected
+            # (there is no way to recover from a failure)
+            with self._step('Unable to disconnect the VPN for open().', \
+                            fatal=True):
+                self._send('disconnect', _VPN_PROMPT_PAT, \
+                           DISCONNECT_TIMEOUT)
+
+            # Initiate a connection with the VPN site
+            with self._step('Got an unexpected VPN connection error.', \
+                            'Unable to complete VPN connection setup.'):
+                index = self._send(connect_cmd, \
+                                   _CONNECT_PATS, CONNECT_TIMEOUT)
+                if index == 1:
+                    # Unable to contact the VPN site
+                    self._fail('Unable to contact ' + vpnsitename)
+                if index == 2:
+                    # Another Cisco AnyConnect application is running
+                    self._fail('Another AnyConnect UI or CLI is running.')
+                if index == 3:
+                    # Cisco AnyConnect cannot verify the VPN server
+                    self._fail('AnyConnect cannot verify the VPN server.', \
+                               'There may be a server certificate issue.')
+                if index == 4:
+                    # Timeout waiting for VPN connection response
+                    self._fail(vpnsitename + ' is not responding.')
+
+            # Enter the VPN login credentials
+            with self._step('Got an unexpected VPN credentials error.', \
+                            'Unable to accept VPN connection credentials.'):
+                self._send(vpnusername, _PASSWORD_PAT, AUTH_TIMEOUT)
+                index = self._send(vpnpassword, _CREDS_PATS, AUTH_TIMEOUT)
+                if index == 1:
+                    # Username and/or Password was not accepted; the
+                    # Cisco AnyConnect CLI is now only listening for
+                    # Username/Password entry
+                    self._fail('VPN Username/Password was not accepted.')
+                if index == 2:
+                    # Timeout waiting for VPN credential entry response
+                    self._fail('VPN credentials response timeout.')
+
+            # Accept the VPN banner
+            with self._step('Got an unexpected VPN banner accept error.', \
+                            'Unable to successfully accept the VPN banner.'):
+                index = self._send('y', _BANNER_PATS, BANNER_TIMEOUT)
+                if index == 1:
+                    # Unable to establish a connection this time
+                    self._fail('Unable to establish a connection this time')
+                if index == 2:
+                    # The Cisco VPN client driver needs a system reboot
+                    self._fail('The VPN client driver encountered an error.', \
+                               'Please restart your system, then try again.')
+                if index == 3:
+                    # Timeout waiting for the VPN banner accept response
+                    self._fail('Banner accept response timeout.')
+                # Success case, if two final checks are satisfied
+                proc.expect(connected_pat, timeout = BANNER_TIMEOUT)
+                proc.expect(_VPN_PROMPT_PAT, timeout = PROMPT_TIMEOUT)
+        except _StepFailed:
             return 'Fail'
 
         # The VPN connection is now established, and the
         # Cisco AnyConnect CLI is waiting for a command
         return 'Good'
 
-        # End of open()
+        # End of _tunnel_up()
 
 
     def close(self):
         """Close the VPN connection
 
         Closes a VPN connection that was opened using the Cisco
-        AnyConnect CLI instance.
+        AnyConnect CLI instance. The CLI instance is left running
+        and waiting for a command, so that the next open() can
+        use it without starting a new one.
 
         Returns 'Good' for success and 'Fail' for failure.
         Failures also result in error messages being sent to the
@@ -408,70 +590,81 @@ class VPNClient:
 
         vpncli note: Short delays are needed between CLI commands,
         otherwise one or more commands might be ignored by the CLI.
+        Each command waits until the CLI output has gone quiet,
+        for no longer than VPNCLI_CMD_DELAY (see _settle()).
         The approach for working with vpncli states and behaviors
         comes from empirical evidence, which may be incomplete.
         """
 
-        # Globals
-        global vpn_proc         # Spawned process ID
-
         # Return 'Good' if the child process is not running,
         # because this means the VPN is already closed; this
         # allows close() to be called at any time, such as when
         # the calling program is being stopped with Control-C
-        if not vpn_proc.isalive():
+        proc = self._vpn_proc
+        if proc is None or not proc.isalive():
             return 'Good'
 
         # Close the VPN connection
         try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline('disconnect')
-            vpn_proc.expect('VPN>')
-        except Exception as error:
-            print('Unable to disconnect the VPN for close().')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # There is no way to recover; attempt to shut down
-            # the Cisco AnyConnect CLI instance and return with
-            # a failure
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (442).')
+            with self._step('Unable to disconnect the VPN for close().'):
+                self._send('disconnect', _VPN_PROMPT_PAT, \
+                           DISCONNECT_TIMEOUT)
+        except _StepFailed:
             return 'Fail'
 
-        # Exit the Cisco AnyConnect CLI
-        try:
-            time.sleep(VPNCLI_CMD_DELAY)
-            vpn_proc.sendline('exit')
-            vpn_proc.expect('>')
-        except Exception as error:
-            print('Unable to exit Cisco AnyConnect CLI for close().')
-            print('---- Start diagnostic information ----')
-            print(vpn_proc.before)
-            print('----  End diagnostic information  ----')
-            # There is no way to recover; attempt to shut down
-            # the Cisco AnyConnect CLI instance and return with
-            # a failure
-            try:
-                vpn_proc.terminate(force=True)
-                wexpect.host.run('taskkill /f /im vpncli.exe')
-            except Exception as error:
-                print('Unable to terminate child process (462).')
+        # Return 'Good' for sucessfully closing the VPN connection
+        return 'Good'
+
+        # End of close()
+
+
+    def shutdown(self):
+        """Shut down the Cisco AnyConnect CLI
+
+        Closes the VPN connection, if it is open, and then exits
+        the Cisco AnyConnect CLI instance that is kept running
+        between open() and close() calls. The child process is
+        given up to CLI_EXIT_TIMEOUT seconds to end by itself, and
+        is only terminated if it is still running after that.
+        Call shutdown() when the VPNClient instance is no longer
+        needed, such as when the calling program ends. open() can
+        still be called afterwards, and will start a new CLI
+        instance.
+
+        Returns 'Good' for success and 'Fail' for failure.
+        Failures also result in error messages being sent to the
+        console.
+        """
+
+        # Close the VPN connection; this also returns 'Good' if
+        # the child process is not running
+        self._cli_ready = False
+        if self.close() != 'Good':
             return 'Fail'
+        proc = self._vpn_proc
+        if proc is None or not proc.isalive():
+            return 'Good'
 
-        # Terminate the child process that was spawned by open()
-        # and ensure the Cisco AnyConnect CLI instance is shut down
+        # Exit the Cisco AnyConnect CLI, and then the cmd.exe
+        # session that it was started from
         try:
-            vpn_proc.terminate(force=True)
-            wexpect.host.run('taskkill /f /im vpncli.exe')
-        except Exception as error:
-            print('Unable to terminate child process (471).')
+            with self._step('Unable to exit Cisco AnyConnect CLI ' \
+                            'for shutdown().'):
+                self._send('exit', _CMD_PROMPT_PAT, PROMPT_TIMEOUT)
+                proc.sendline('exit')
+        except _StepFailed:
             return 'Fail'
 
-        # Return 'Good' for sucessfully closing the VPN connection
+        # Wait a short time for the child process to end by itself;
+        # vpncli has already exited, so there is nothing to clean up
+        # if it does. Otherwise, terminate the child process that was
+        # spawned by open() and ensure the Cisco AnyConnect CLI
+        # instance is shut down.
+        deadline = time.monotonic() + CLI_EXIT_TIMEOUT
+        while proc.isalive():
+            if time.monotonic() >= deadline:
+                return self._terminate()
+            time.sleep(CLI_EXIT_POLL)
         return 'Good'
 
-        # End of close()
+        # End of shutdown()